@@ -3,15 +3,24 @@ Databoy – Flexible Flask backend
 Handles ANY number of questions in ECZ Grade 7 Integrated Science papers
 """
 
+import asyncio
+import gzip
+import hashlib
+import io
 import os
 import re
-import json
+import sqlite3
+import tempfile
 import traceback
 import uuid
+from collections import Counter
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
+import orjson
 from flask import Flask, request as flask_request, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from dotenv import load_dotenv
 
@@ -32,21 +41,67 @@ if not GEMINI_API_KEY:
 
 client = genai.Client(api_key=GEMINI_API_KEY)
 
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson – 3-10× faster than stdlib json"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__, static_folder='../frontend', static_url_path='')
+app.json = OrjsonProvider(app)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# Reject oversized requests before any body is read into memory (Flask
+# returns 413 from the declared Content-Length alone)
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_UPLOAD_MB", "25")) * 1024 * 1024
+
+# Only types Gemini can actually extract questions from
+ALLOWED_UPLOAD_TYPES = {"application/pdf", "image/png", "image/jpeg"}
+
 # Quiz storage configuration
 QUIZZES_DIR = Path('../quizzes')
 QUIZZES_DIR.mkdir(exist_ok=True)
 
+# Authoritative quiz manifest – listing is one indexed query instead of a
+# directory walk + JSON parse per quiz
+INDEX_DB = QUIZZES_DIR / 'index.db'
+
 # D³ Engine storage configuration
 D3_DIR = Path('../d3_analyses')
 D3_DIR.mkdir(exist_ok=True)
 
+# Extraction cache – keyed by PDF content hash so identical re-uploads
+# skip the Gemini pipeline entirely
+CACHE_DIR = Path('../pdf_cache')
+CACHE_DIR.mkdir(exist_ok=True)
+
 MODEL_NAME = "gemini-2.5-flash"  # or "gemini-2.5-flash-latest"
 
+# Stored JSON is only ever read back by the server – indentation doubles file
+# size and write time, so pretty-print only when explicitly debugging
+JSON_DUMP_OPTS = orjson.OPT_INDENT_2 if os.getenv("DEBUG_JSON", "").lower() == "true" else 0
+
 # ── Server-Side Quiz Storage ────────────────────────────────────────────────────
 
+def _quiz_file_path(quiz_id: str) -> Path:
+    """Stored quiz path – gzip-compressed by default, plain .json for quizzes
+    saved before compression existed"""
+    gz_file = QUIZZES_DIR / f'{quiz_id}.json.gz'
+    if gz_file.exists():
+        return gz_file
+    return QUIZZES_DIR / f'{quiz_id}.json'
+
+def _read_quiz_file(quiz_file: Path) -> dict:
+    if quiz_file.name.endswith('.gz'):
+        with gzip.open(quiz_file, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(quiz_file, 'rb') as f:
+        return orjson.loads(f.read())
+
 def save_quiz_to_server(quiz_name: str, quiz_data: list) -> dict:
     """Save quiz to server file system"""
     try:
@@ -59,44 +114,135 @@ def save_quiz_to_server(quiz_name: str, quiz_data: list) -> dict:
             'data': quiz_data
         }
         
-        quiz_file = QUIZZES_DIR / f'{quiz_id}.json'
-        with open(quiz_file, 'w') as f:
-            json.dump(quiz_entry, f, indent=2)
-        
+        # Quiz JSON compresses ~5-10× and level 3 is near-free CPU-wise.
+        # Write to a temp name and rename to commit – os.replace is atomic,
+        # so a crash mid-write can never leave a half-written quiz behind
+        quiz_file = QUIZZES_DIR / f'{quiz_id}.json.gz'
+        tmp_file = quiz_file.with_name(quiz_file.name + '.tmp')
+        with gzip.open(tmp_file, 'wb', compresslevel=3) as f:
+            f.write(orjson.dumps(quiz_entry, option=JSON_DUMP_OPTS))
+        os.replace(tmp_file, quiz_file)
+
+        # Tiny sidecar with just the header fields so listing never has to
+        # parse the full 'data' array
+        meta = {k: quiz_entry[k] for k in ('id', 'name', 'timestamp', 'questionCount')}
+        meta_file = QUIZZES_DIR / f'{quiz_id}.meta.json'
+        tmp_meta = meta_file.with_name(meta_file.name + '.tmp')
+        with open(tmp_meta, 'wb') as f:
+            f.write(orjson.dumps(meta))
+        os.replace(tmp_meta, meta_file)
+
+        # Keep the manifest authoritative – listing never touches the files
+        conn = sqlite3.connect(INDEX_DB)
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO quizzes VALUES (?, ?, ?, ?)",
+                    (quiz_entry['id'], quiz_entry['name'],
+                     quiz_entry['timestamp'], quiz_entry['questionCount'])
+                )
+        finally:
+            conn.close()
+
         print(f"[Storage] Quiz saved: {quiz_file}")
         return quiz_entry
     except Exception as e:
         print(f"[Storage] Failed to save quiz: {e}")
         raise
 
+@lru_cache(maxsize=128)
+def _load_quiz_cached(quiz_file: Path, mtime_ns: int) -> dict:
+    """Parse a quiz file once per (path, mtime) – repeat GETs during a quiz
+    session hit memory instead of disk + JSON parse"""
+    return _read_quiz_file(quiz_file)
+
 def load_quiz_from_server(quiz_id: str) -> dict:
     """Load quiz from server file system"""
     try:
-        quiz_file = QUIZZES_DIR / f'{quiz_id}.json'
+        quiz_file = _quiz_file_path(quiz_id)
         if not quiz_file.exists():
             raise FileNotFoundError(f"Quiz {quiz_id} not found")
-        
-        with open(quiz_file, 'r') as f:
-            return json.load(f)
+
+        # mtime in the cache key auto-invalidates when the file changes
+        return _load_quiz_cached(quiz_file, quiz_file.stat().st_mtime_ns)
     except Exception as e:
         print(f"[Storage] Failed to load quiz: {e}")
         raise
 
+def _scan_quiz_metadata() -> list:
+    """Walk the quiz directory and return header metadata for every stored
+    quiz – used only to (re)build the manifest, never on the listing path"""
+    quizzes = []
+    with os.scandir(QUIZZES_DIR) as entries:
+        names = {entry.name for entry in entries}
+    quiz_ids = set()
+    for name in names:
+        if name.endswith('.meta.json'):
+            continue
+        if name.endswith('.json.gz'):
+            quiz_ids.add(name[:-len('.json.gz')])
+        elif name.endswith('.json'):
+            quiz_ids.add(name[:-len('.json')])
+    for quiz_id in quiz_ids:
+        # One corrupt or truncated file must not break the whole scan
+        try:
+            meta_name = f'{quiz_id}.meta.json'
+            if meta_name in names:
+                # ~100-byte sidecar – no need to parse the full 'data' array
+                with open(QUIZZES_DIR / meta_name, 'rb') as f:
+                    quizzes.append(orjson.loads(f.read()))
+            else:
+                # Legacy quiz saved before sidecars existed – parse once and
+                # backfill, with the same atomic write as save_quiz_to_server
+                quiz_data = _read_quiz_file(_quiz_file_path(quiz_id))
+                meta = {k: quiz_data[k] for k in ('id', 'name', 'timestamp', 'questionCount')}
+                meta_file = QUIZZES_DIR / meta_name
+                tmp_meta = meta_file.with_name(meta_file.name + '.tmp')
+                with open(tmp_meta, 'wb') as f:
+                    f.write(orjson.dumps(meta))
+                os.replace(tmp_meta, meta_file)
+                quizzes.append(meta)
+        except Exception as e:
+            print(f"[Storage] Skipping unreadable quiz {quiz_id}: {e}")
+    return quizzes
+
+def _init_quiz_index():
+    """Create the manifest table and backfill any quizzes saved before the
+    index existed (or while it was lost)"""
+    conn = sqlite3.connect(INDEX_DB)
+    try:
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS quizzes ("
+                "id TEXT PRIMARY KEY, name TEXT, timestamp TEXT, question_count INT)"
+            )
+            indexed = {row[0] for row in conn.execute("SELECT id FROM quizzes")}
+            for meta in _scan_quiz_metadata():
+                if meta['id'] not in indexed:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO quizzes VALUES (?, ?, ?, ?)",
+                        (meta['id'], meta['name'], meta['timestamp'], meta['questionCount'])
+                    )
+    finally:
+        conn.close()
+
+_init_quiz_index()
+
 def list_quizzes_from_server() -> list:
     """List all quizzes on server"""
     try:
-        quizzes = []
-        for quiz_file in QUIZZES_DIR.glob('*.json'):
-            with open(quiz_file, 'r') as f:
-                quiz_data = json.load(f)
-                # Exclude the full data from list view for efficiency
-                quizzes.append({
-                    'id': quiz_data['id'],
-                    'name': quiz_data['name'],
-                    'timestamp': quiz_data['timestamp'],
-                    'questionCount': quiz_data['questionCount']
-                })
-        return sorted(quizzes, key=lambda x: x['timestamp'], reverse=True)
+        conn = sqlite3.connect(INDEX_DB)
+        try:
+            rows = conn.execute(
+                "SELECT id, name, timestamp, question_count FROM quizzes "
+                "ORDER BY timestamp DESC"
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            {'id': r[0], 'name': r[1], 'timestamp': r[2], 'questionCount': r[3]}
+            for r in rows
+        ]
     except Exception as e:
         print(f"[Storage] Failed to list quizzes: {e}")
         return []
@@ -104,9 +250,22 @@ def list_quizzes_from_server() -> list:
 def delete_quiz_from_server(quiz_id: str) -> bool:
     """Delete quiz from server"""
     try:
-        quiz_file = QUIZZES_DIR / f'{quiz_id}.json'
-        if quiz_file.exists():
-            quiz_file.unlink()
+        deleted = False
+        # Remove both the compressed and any legacy uncompressed copy
+        for quiz_file in (QUIZZES_DIR / f'{quiz_id}.json.gz', QUIZZES_DIR / f'{quiz_id}.json'):
+            if quiz_file.exists():
+                quiz_file.unlink()
+                deleted = True
+        if deleted:
+            meta_file = QUIZZES_DIR / f'{quiz_id}.meta.json'
+            if meta_file.exists():
+                meta_file.unlink()
+            conn = sqlite3.connect(INDEX_DB)
+            try:
+                with conn:
+                    conn.execute("DELETE FROM quizzes WHERE id = ?", (quiz_id,))
+            finally:
+                conn.close()
             print(f"[Storage] Quiz deleted: {quiz_id}")
             return True
         return False
@@ -114,32 +273,62 @@ def delete_quiz_from_server(quiz_id: str) -> bool:
         print(f"[Storage] Failed to delete quiz: {e}")
         return False
 
+# ── Extraction Cache ───────────────────────────────────────────────────────────
+
+def extraction_cache_key(pdf_path: Path) -> str:
+    """Content hash of the PDF, salted with the model so prompt/model changes invalidate"""
+    h = hashlib.sha256()
+    h.update(MODEL_NAME.encode())
+    with open(pdf_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_cached_extraction(cache_key: str):
+    """Return cached questions for this PDF hash, or None on miss"""
+    cache_file = CACHE_DIR / f'{cache_key}.json'
+    if not cache_file.exists():
+        return None
+    try:
+        with open(cache_file, 'rb') as f:
+            return orjson.loads(f.read())
+    except Exception as e:
+        print(f"[Cache] Failed to read {cache_file}: {e}")
+        return None
+
+def save_cached_extraction(cache_key: str, questions: list):
+    """Write the extraction result atomically so a crash never leaves a corrupt entry"""
+    try:
+        cache_file = CACHE_DIR / f'{cache_key}.json'
+        tmp_file = cache_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'wb') as f:
+            f.write(orjson.dumps(questions))
+        os.replace(tmp_file, cache_file)
+        print(f"[Cache] Extraction cached: {cache_file}")
+    except Exception as e:
+        print(f"[Cache] Failed to write cache: {e}")
+
 # ── Prompts ────────────────────────────────────────────────────────────────────
 
-PROMPT_COUNT = """
+PROMPT_COMBINED = """
 This is a scanned Zambian ECZ Grade 7 Integrated Science exam paper.
 
-Read the entire document carefully and tell me ONLY the total number of multiple-choice questions.
+First determine the TOTAL number of multiple-choice questions in the paper.
 Look for phrases like "There are 50 questions" or count the numbered questions (1, 2, 3...).
 
-Output ONLY a single integer (e.g. 50, 40, 60). No other text.
-"""
-
-PROMPT_ALL = """
-Extract ALL multiple-choice questions from this Zambian ECZ Grade 7 Integrated Science exam paper.
-
-Rules – follow exactly:
+Then extract the questions. Rules – follow exactly:
+- If the paper has 40 questions or fewer, extract ALL of them; otherwise extract ONLY questions 1 to 40.
 - Ignore instructions, headers, footers, watermarks, page numbers, STOP, QR codes.
 - Fix OCR typos (assimillation → assimilation, coartem → Coartem, tse-tsefly → tsetse fly, diarrhoea → diarrhoea, anaemia → anaemia).
 - Question text complete and grammatical.
-- Options MUST be array of objects: [{{"letter":"A","text":"..."}}, {{"letter":"B","text":"..."}}, {{"letter":"C","text":"..."}}, {{"letter":"D","text":"..."}}] – NEVER plain strings.
+- Options MUST be array of objects: [{"letter":"A","text":"..."}, {"letter":"B","text":"..."}, {"letter":"C","text":"..."}, {"letter":"D","text":"..."}] – NEVER plain strings.
 - Diagrams: short neutral "diagram_description" or null.
 - Deduce correct answer ("A","B","C","D") using Grade 7 science facts.
-- Every object MUST have: "number" (integer starting from 1), "question", "options", "correct", "diagram_description".
-- Output ONLY valid JSON array. No text, no fences, no trailing commas.
+- Every question object MUST have: "number" (integer starting from 1), "question", "options", "correct", "diagram_description".
+- Output ONLY a valid JSON object {"count": <total>, "questions": [...]}. No text, no fences, no trailing commas.
 
 Example:
-[{{"number":1,"question":"...","options":[{{"letter":"A","text":"..."}},...],"correct":"C","diagram_description":null}}, ...]
+{"count":50,"questions":[{"number":1,"question":"...","options":[{"letter":"A","text":"..."},...],"correct":"C","diagram_description":null}, ...]}
 """
 
 PROMPT_PART = """
@@ -156,15 +345,18 @@ Same rules as above:
 
 # ── Helpers ────────────────────────────────────────────────────────────────────
 
-def extract_json_array(text: str) -> list:
-    text = re.sub(r'^```(?:json)?\s*', '', text.strip(), flags=re.MULTILINE | re.IGNORECASE)
-    text = re.sub(r'```\s*$', '', text.strip(), flags=re.MULTILINE | re.IGNORECASE)
-    text = text.strip()
+# Strips opening/closing markdown code fences around Gemini's JSON output –
+# compiled once instead of per extraction call
+_FENCE_RE = re.compile(r'^```(?:json)?\s*|\s*```\s*$', re.IGNORECASE | re.MULTILINE)
+
+
+def extract_json(text: str):
+    text = _FENCE_RE.sub('', text.strip()).strip()
 
     try:
-        return json.loads(text)
-    except json.JSONDecodeError as e:
-        print(f"json.loads failed: {e}")
+        return orjson.loads(text)
+    except orjson.JSONDecodeError as e:
+        print(f"orjson.loads failed: {e}")
         if json5:
             try:
                 return json5.loads(text)
@@ -173,47 +365,49 @@ def extract_json_array(text: str) -> list:
         raise
 
 
-def fix_options_format(questions: list):
-    for q in questions:
-        opts = q.get("options", [])
-        if opts and isinstance(opts[0], str):
-            fixed = []
-            letters = ["A", "B", "C", "D"]
-            for i, txt in enumerate(opts[:4]):
-                fixed.append({"letter": letters[i], "text": txt.strip()})
-            q["options"] = fixed
-            print(f"Fixed options format for q{q.get('number')}")
-    return questions
-
-
-def normalize_field_names(questions: list):
-    for q in questions:
+def normalize_questions(questions: list, start_num: int = 1):
+    """Single pass over the questions: rename legacy fields, convert string
+    options to letter/text objects, and force sequential numbering"""
+    letters = ["A", "B", "C", "D"]
+    for i, q in enumerate(questions, start=start_num):
         if "answer" in q:
             q["correct"] = q.pop("answer")
         if "text" in q and "question" not in q:
             q["question"] = q.pop("text")
         if "diagram" in q and "diagram_description" not in q:
             q["diagram_description"] = q.pop("diagram")
-    return questions
 
+        opts = q.get("options", [])
+        if opts and isinstance(opts[0], str):
+            q["options"] = [
+                {"letter": letters[j], "text": txt.strip()}
+                for j, txt in enumerate(opts[:4])
+            ]
+            print(f"Fixed options format for q{q.get('number')}")
 
-def fix_numbering(questions: list, start_num: int = 1):
-    for i, q in enumerate(questions, start=start_num):
         if q.get("number") != i:
             print(f"Correcting number: was {q.get('number')} → {i}")
             q["number"] = i
     return questions
 
 
-def call_gemini(file_bytes: bytes, prompt: str, mime_type: str = "application/pdf") -> list:
-    response = client.models.generate_content(
+def build_file_part(file_ref, mime_type: str = "application/pdf") -> types.Part:
+    """Build a request part from raw bytes or an uploaded Files API handle"""
+    if isinstance(file_ref, (bytes, bytearray)):
+        return types.Part(inline_data=types.Blob(mime_type=mime_type, data=bytes(file_ref)))
+    # Files API object – reference by URI instead of re-sending the bytes
+    return types.Part(file_data=types.FileData(file_uri=file_ref.uri, mime_type=mime_type))
+
+
+async def call_gemini(file_ref, prompt: str, mime_type: str = "application/pdf"):
+    response = await client.aio.models.generate_content(
         model=MODEL_NAME,
         contents=[
             types.Content(
                 role="user",
                 parts=[
                     types.Part(text=prompt),
-                    types.Part(inline_data=types.Blob(mime_type=mime_type, data=file_bytes)),
+                    build_file_part(file_ref, mime_type),
                 ]
             )
         ],
@@ -225,84 +419,58 @@ def call_gemini(file_bytes: bytes, prompt: str, mime_type: str = "application/pd
     )
     raw = response.text.strip()
     print(f"[Gemini] Response length: {len(raw)} chars")
-    return extract_json_array(raw)
+    return extract_json(raw)
 
 
-def call_gemini_count(file_bytes: bytes, prompt: str, mime_type: str = "application/pdf") -> int:
-    """Call Gemini specifically for question count (returns int, not array)"""
-    try:
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=[
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part(text=prompt),
-                        types.Part(inline_data=types.Blob(mime_type=mime_type, data=file_bytes)),
-                    ]
-                )
-            ],
-            config=types.GenerateContentConfig(
-                temperature=0.0,
-                max_output_tokens=256
-            )
-        )
-        raw = response.text.strip()
-        print(f"[Gemini] Count response: {raw}")
-        # Extract just the number from the response
-        import re
-        match = re.search(r'\d+', raw)
-        if match:
-            return int(match.group())
-        raise ValueError(f"Could not extract count from: {raw}")
-    except Exception as e:
-        print(f"[Gemini] Count extraction error: {e}")
-        raise
+async def call_gemini_combined(file_ref, mime_type: str = "application/pdf"):
+    """Single call returning (total question count, first batch of questions) –
+    replaces the old dedicated count round-trip"""
+    result = await call_gemini(file_ref, PROMPT_COMBINED, mime_type)
+    if not isinstance(result, dict) or "count" not in result:
+        raise ValueError(f"Combined response missing count: {str(result)[:200]}")
+    return int(result["count"]), result.get("questions") or []
 
 
-def process_pdf_with_gemini(file_bytes: bytes, filename: str, mime_type: str = "application/pdf") -> list:
-    print(f"[Start] {filename} ({len(file_bytes)//1024} KB)")
+async def process_pdf_with_gemini(pdf_path: Path, filename: str, mime_type: str = "application/pdf") -> list:
+    print(f"[Start] {filename} ({pdf_path.stat().st_size//1024} KB)")
+
+    # Upload the PDF once – every Gemini call references the handle instead
+    # of re-sending the full bytes inline (3× upload bandwidth otherwise).
+    # The SDK streams from the path, so the PDF never sits in RAM whole.
+    uploaded_file = await client.aio.files.upload(
+        path=str(pdf_path),
+        config={"mime_type": mime_type}
+    )
+    print(f"[Gemini] File uploaded: {uploaded_file.name}")
 
-    # Step 1: Detect total number of questions
-    print("[Gemini] Detecting total questions...")
     try:
-        total_questions = call_gemini_count(file_bytes, PROMPT_COUNT, mime_type)
-        print(f"[Info] Paper has {total_questions} questions")
-    except Exception as e:
-        print(f"Count parsing failed: {e}")
-        raise ValueError("Could not detect number of questions in PDF")
-
-    # Step 2: Extraction strategy
-    questions = []
-    if total_questions <= 40:
-        print("[Gemini] Single call – extracting all questions...")
-        questions = call_gemini(file_bytes, PROMPT_ALL, mime_type)
-    else:
-        mid = total_questions // 2
-        print(f"[Gemini] Splitting: 1–{mid} + {mid+1}–{total_questions}")
-        part1_prompt = PROMPT_PART.format(start=1, end=mid)
-        part2_prompt = PROMPT_PART.format(start=mid+1, end=total_questions)
-
-        part1 = call_gemini(file_bytes, part1_prompt, mime_type)
-        part2 = call_gemini(file_bytes, part2_prompt, mime_type)
-
-        part1 = fix_options_format(part1)
-        part2 = fix_options_format(part2)
-        part2 = fix_numbering(part2, mid+1)
-
-        questions = part1 + part2
-
-    # Step 3: Final fixes
-    questions = fix_options_format(questions)
-    questions = normalize_field_names(questions)
-
-    # Step 4: Validation (flexible – no hard 50)
-    numbers = [q.get("number") for q in questions if isinstance(q.get("number"), int)]
-    expected = list(range(1, len(questions) + 1))
-    if sorted(numbers) != expected:
-        print(f"Warning: numbers {sorted(numbers)} ≠ expected {expected} → auto-fixing")
-        for i, q in enumerate(questions, 1):
-            q["number"] = i
+        # Steps 1+2 fused: one call returns the paper's total count plus the
+        # first (up to) 40 questions, so papers of ≤40 questions finish in a
+        # single round-trip and longer papers need only one follow-up call
+        print("[Gemini] Combined count + extraction call...")
+        try:
+            total_questions, questions = await call_gemini_combined(uploaded_file, mime_type)
+            print(f"[Info] Paper has {total_questions} questions")
+        except Exception as e:
+            print(f"Combined extraction failed: {e}")
+            raise ValueError("Could not detect number of questions in PDF")
+
+        if total_questions > 40:
+            print(f"[Gemini] Fetching remaining questions 41–{total_questions}")
+            rest_prompt = PROMPT_PART.format(start=41, end=total_questions)
+            try:
+                questions = questions + await call_gemini(uploaded_file, rest_prompt, mime_type)
+            except Exception as e:
+                raise ValueError(f"Extraction of questions 41–{total_questions} failed: {e}")
+    finally:
+        try:
+            await client.aio.files.delete(name=uploaded_file.name)
+        except Exception as e:
+            print(f"[Gemini] Failed to delete uploaded file: {e}")
+
+    # Step 3: Final fixes – one fused pass over the merged list, which also
+    # forces sequential 1..n numbering (logging any corrections)
+    questions = normalize_questions(questions)
 
     print(f"[Success] Extracted {len(questions)} questions")
     return questions
@@ -311,14 +479,14 @@ def process_pdf_with_gemini(file_bytes: bytes, filename: str, mime_type: str = "
 # ── Routes ─────────────────────────────────────────────────────────────────────
 
 @app.route("/upload", methods=["POST"])
-def upload_file():
+async def upload_file():
     if "file" not in flask_request.files and "quiz_data" not in flask_request.form:
         return jsonify({"success": False, "message": "No file or quiz_data provided"}), 400
 
     # Check if JSON quiz data is provided directly
     if "quiz_data" in flask_request.form:
         try:
-            quiz_data = json.loads(flask_request.form["quiz_data"])
+            quiz_data = orjson.loads(flask_request.form["quiz_data"])
             # Validate the quiz data format
             if not isinstance(quiz_data, list):
                 return jsonify({"success": False, "message": "Quiz data must be a JSON array"}), 400
@@ -348,7 +516,7 @@ def upload_file():
                 "message": f"Quiz loaded successfully – {len(quiz_data)} questions"
             })
 
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             return jsonify({"success": False, "message": "Invalid JSON format"}), 400
 
     # Handle PDF file upload
@@ -357,10 +525,26 @@ def upload_file():
         return jsonify({"success": False, "message": "No file selected"}), 400
 
     mime_type = uploaded.mimetype or "application/pdf"
+    if mime_type not in ALLOWED_UPLOAD_TYPES:
+        return jsonify({"success": False, "message": f"Unsupported file type: {mime_type}"}), 400
+
+    # Stream the upload to a temp file instead of reading it into a bytes
+    # object – keeps peak memory flat regardless of PDF size
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    tmp_path = Path(tmp.name)
+    tmp.close()
 
     try:
-        file_bytes = uploaded.read()
-        questions = process_pdf_with_gemini(file_bytes, uploaded.filename, mime_type)
+        uploaded.save(tmp_path)
+
+        # Identical PDF re-uploads skip the Gemini pipeline entirely
+        cache_key = extraction_cache_key(tmp_path)
+        questions = load_cached_extraction(cache_key)
+        if questions is not None:
+            print(f"[Cache] Hit for {uploaded.filename} – skipping extraction")
+        else:
+            questions = await process_pdf_with_gemini(tmp_path, uploaded.filename, mime_type)
+            save_cached_extraction(cache_key, questions)
 
         # Save to server
         quiz_entry = save_quiz_to_server(uploaded.filename, questions)
@@ -376,6 +560,8 @@ def upload_file():
     except Exception as e:
         traceback.print_exc()
         return jsonify({"success": False, "message": str(e)}), 500
+    finally:
+        tmp_path.unlink(missing_ok=True)
 
 
 @app.route("/health", methods=["GET"])
@@ -434,22 +620,59 @@ def delete_quiz(quiz_id):
 
 # ── D³ Engine API Endpoints ────────────────────────────────────────────────────
 
-def extract_topics_from_text(text: str) -> list:
-    """Extract key topics from text using Gemini"""
+# Stopwords for the local keyword pass – common English plus words that show
+# up in any exam paper regardless of subject
+_STOPWORDS = frozenset("""
+a about above after again all also an and any are as at be because been before
+being below between both but by can could did do does doing down during each
+few for from further had has have having he her here hers him his how if in
+into is it its just me more most my no nor not now of off on once only or
+other our out over own same she should so some such than that the their them
+then there these they this those through to too under until up very was we
+were what when where which while who whom why will with would you your
+answer answers choose correct exam example following marks page paper part
+question questions section study test write
+""".split())
+
+
+def local_topic_candidates(text: str, top_n: int = 10) -> list:
+    """Cheap local keyword extraction – term-frequency over unigrams and
+    bigrams with stopword filtering. Good enough to shortlist candidate
+    topics without paying a Gemini round-trip per document."""
+    words = re.findall(r"[a-zA-Z][a-zA-Z'-]{2,}", text.lower())
+    counts = Counter()
+    prev = None
+    for w in words:
+        if w in _STOPWORDS:
+            prev = None
+            continue
+        counts[w] += 1
+        if prev is not None:
+            # Bigrams are more specific topics – weight them up
+            counts[f"{prev} {w}"] += 2
+        prev = w
+    return [term for term, _ in counts.most_common(top_n)]
+
+
+async def refine_topics_with_gemini(candidates: list) -> list:
+    """One consolidation call per training batch: turn the raw local keyword
+    candidates into clean exam-topic labels"""
     try:
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model=MODEL_NAME,
             contents=[
                 types.Content(
                     role="user",
                     parts=[
-                        types.Part(text=f"""Analyze this educational material and extract the TOP 10 most important topics/concepts that are commonly tested in exams. 
-Be concise and specific. Return ONLY a JSON array of topic strings, no other text.
+                        types.Part(text=f"""These keyword candidates were extracted from educational material.
+Consolidate them into the TOP 15 most important exam topics/concepts.
+Merge duplicates, fix casing, and drop noise terms.
+Return ONLY a JSON array of topic strings, no other text.
 
 Example format: ["Topic 1", "Topic 2", "Topic 3"]
 
-Material:
-{text[:3000]}""")
+Candidates:
+{orjson.dumps(candidates).decode()}""")
                     ]
                 )
             ],
@@ -459,45 +682,73 @@ Material:
                 response_mime_type="application/json"
             )
         )
-        topics = json.loads(response.text)
+        topics = orjson.loads(response.text)
         return topics if isinstance(topics, list) else []
     except Exception as e:
-        print(f"[D3] Topic extraction failed: {e}")
+        print(f"[D3] Topic refinement failed: {e}")
         return []
 
-def analyze_d3_documents(files_data: dict) -> dict:
+@lru_cache(maxsize=256)
+def _topic_candidates_cached(content: str) -> tuple:
+    """Duplicate documents in (or across) training batches share one
+    extraction – keyed by the bounded 5000-char content itself"""
+    return tuple(local_topic_candidates(content))
+
+
+def _process_d3_file(category: str, file_obj):
+    """Read one uploaded document and extract local topic candidates"""
+    # Bind the name before the try block – the error handler below logs it,
+    # and referencing it unbound would mask the real failure with a NameError
+    filename = file_obj.filename
+    try:
+        # For demo: extract text (in production would use proper PDF/DOCX extraction).
+        # Read only the first 5000 chars through a text wrapper – no point
+        # decoding a whole multi-MB upload just to slice it afterwards
+        content = io.TextIOWrapper(file_obj.stream, encoding='utf-8', errors='ignore').read(5000)
+        topics = list(_topic_candidates_cached(content))
+        return {
+            "name": filename,
+            "category": category,
+            "topics": topics
+        }
+    except Exception as e:
+        print(f"[D3] Error processing {filename}: {e}")
+        return None
+
+
+async def analyze_d3_documents(files_data: dict) -> dict:
     """Analyze uploaded documents with D³ Engine"""
     try:
         analysis_id = str(uuid.uuid4())[:8]
         all_topics = []
         file_summaries = []
 
-        # Process documents
-        for category, files_list in files_data.items():
-            for file_obj in files_list:
-                try:
-                    # For demo: extract text (in production would use proper PDF/DOCX extraction)
-                    filename = file_obj.filename
-                    content = file_obj.read().decode('utf-8', errors='ignore')[:5000]
-
-                    # Extract topics
-                    topics = extract_topics_from_text(content)
-                    all_topics.extend(topics)
-
-                    file_summaries.append({
-                        "name": filename,
-                        "category": category,
-                        "topics_found": len(topics),
-                        "samples": topics[:3]
-                    })
-                except Exception as e:
-                    print(f"[D3] Error processing {filename}: {e}")
-                    continue
-
-        # Deduplicate and rank topics
-        from collections import Counter
+        # Per-file reads are independent – fan them out instead of looping
+        # serially, so batch wall time is max-of-files not sum-of-files
+        tasks = [
+            asyncio.to_thread(_process_d3_file, category, file_obj)
+            for category, files_list in files_data.items()
+            for file_obj in files_list
+        ]
+        for result in await asyncio.gather(*tasks):
+            if result is None:
+                continue
+            topics = result["topics"]
+            all_topics.extend(topics)
+            file_summaries.append({
+                "name": result["name"],
+                "category": result["category"],
+                "topics_found": len(topics),
+                "samples": topics[:3]
+            })
+
+        # Deduplicate and rank candidates, then make a single Gemini call for
+        # the whole batch to consolidate them into clean topic labels
         topic_counts = Counter(all_topics)
-        ranked_topics = [topic for topic, _ in topic_counts.most_common(15)]
+        ranked_candidates = [topic for topic, _ in topic_counts.most_common(30)]
+        ranked_topics = await refine_topics_with_gemini(ranked_candidates)
+        if not ranked_topics:
+            ranked_topics = ranked_candidates[:15]
 
         analysis_result = {
             "id": analysis_id,
@@ -511,8 +762,8 @@ def analyze_d3_documents(files_data: dict) -> dict:
 
         # Save analysis
         analysis_file = D3_DIR / f'{analysis_id}.json'
-        with open(analysis_file, 'w') as f:
-            json.dump(analysis_result, f, indent=2)
+        with open(analysis_file, 'wb') as f:
+            f.write(orjson.dumps(analysis_result, option=JSON_DUMP_OPTS))
 
         print(f"[D3] Analysis saved: {analysis_file}")
         return analysis_result
@@ -522,7 +773,7 @@ def analyze_d3_documents(files_data: dict) -> dict:
         raise
 
 @app.route("/api/d3-engine/train", methods=["POST"])
-def train_d3_engine():
+async def train_d3_engine():
     """Train D³ Engine with uploaded documents"""
     try:
         files_data = {
@@ -541,7 +792,7 @@ def train_d3_engine():
             }), 400
 
         # Analyze documents
-        analysis = analyze_d3_documents(files_data)
+        analysis = await analyze_d3_documents(files_data)
 
         return jsonify({
             "success": True,
@@ -567,8 +818,8 @@ def get_d3_analysis(analysis_id):
         if not analysis_file.exists():
             raise FileNotFoundError(f"Analysis {analysis_id} not found")
 
-        with open(analysis_file, 'r') as f:
-            analysis = json.load(f)
+        with open(analysis_file, 'rb') as f:
+            analysis = orjson.loads(f.read())
 
         return jsonify({
             "success": True,